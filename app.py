@@ -1,25 +1,286 @@
-from flask import Flask, request, jsonify
-from datetime import datetime
+from flask import Flask, request, jsonify, Response, stream_with_context, g
+from datetime import datetime, timedelta
 import uuid
+import base64
+import hashlib
+import asyncio
+import json
+import random
 import requests
 import stripe
-from pymongo import MongoClient
+from requests.adapters import HTTPAdapter
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import PyMongoError, DuplicateKeyError
 from dotenv import load_dotenv
 import os
+import sys
 import logging
+import threading
+import time
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from itsdangerous import URLSafeSerializer, BadSignature
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.DEBUG)
 
 # Load environment variables from .env file
 load_dotenv()
 
+# DEBUG logging is expensive on the hot path, turn it on with LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+
+# Metrics and profiling
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+
+class Metrics:
+    """Latency histograms and counters rendered in Prometheus text format."""
+
+    HELP = {
+        "http_request_duration_seconds": "Request latency by route, method and status.",
+        "dependency_duration_seconds": "Latency of calls to Mongo, Amadeus and Stripe.",
+        "dependency_errors_total": "Failed calls to Mongo, Amadeus and Stripe."
+    }
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    @contextmanager
+    def timed(self, dependency, operation, expected=()):
+        # ``expected`` exceptions are outcomes the caller handles, not dependency errors
+        started = time.perf_counter()
+        try:
+            yield
+        except expected:
+            raise
+        except Exception:
+            self.inc('dependency_errors_total', dependency=dependency, operation=operation)
+            raise
+        finally:
+            self.observe('dependency_duration_seconds', time.perf_counter() - started,
+                         dependency=dependency, operation=operation)
+
+    def render(self, gauges=(), counters=()):
+        # gauges and counters: (name, help, [(labels dict, value), ...]) computed by the caller
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, values in sorted(series.items()):
+                    labels = dict(key)
+                    for bound, count in zip(self.buckets, values):
+                        lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+                    lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {values[-1]}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {values[-2]}")
+                    lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(dict(key))} {value}")
+        for kind, entries in (("counter", counters), ("gauge", gauges)):
+            for name, help_text, samples in entries:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+metrics = Metrics()
+
+
+class InstrumentedCursor:
+    """Times reading a pymongo cursor, where ``find`` does its round trips.
+
+    The time spent inside ``next`` (batch fetches included) is summed and
+    observed once, when the cursor is exhausted, fails or is closed, so the
+    caller's work between documents isn't counted.
+    """
+
+    def __init__(self, cursor, operation):
+        self._cursor = cursor
+        self._operation = operation
+        self._elapsed = 0.0
+        self._observed = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def chained_call(*args, **kwargs):
+            # sort, limit, batch_size, ... return the cursor itself
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained_call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            document = next(self._cursor)
+        except StopIteration:
+            self._observe(time.perf_counter() - started)
+            raise
+        except Exception:
+            metrics.inc('dependency_errors_total', dependency='mongo', operation=self._operation)
+            self._observe(time.perf_counter() - started)
+            raise
+        self._elapsed += time.perf_counter() - started
+        return document
+
+    def close(self):
+        self._cursor.close()
+        self._observe(0.0)
+
+    def _observe(self, seconds):
+        self._elapsed += seconds
+        if not self._observed:
+            self._observed = True
+            metrics.observe('dependency_duration_seconds', self._elapsed, dependency='mongo', operation=self._operation)
+
+
+class InstrumentedCollection:
+    """Times every method call on a pymongo collection.
+
+    ``find`` returns an InstrumentedCursor; creating the cursor does no I/O,
+    reading it is what gets timed.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        operation = f"{self._collection.name}.{name}"
+        if name == 'find':
+            return lambda *args, **kwargs: InstrumentedCursor(attr(*args, **kwargs), operation)
+
+        def timed_call(*args, **kwargs):
+            # Duplicate keys are how idempotent inserts detect a replay
+            with metrics.timed('mongo', operation, expected=(DuplicateKeyError,)):
+                return attr(*args, **kwargs)
+        return timed_call
+
+
 # MongoDB Configuration
-client = MongoClient('mongodb://localhost:27017/')
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+client = MongoClient(MONGO_URI)
 db = client['travel_booking_db']
-users_collection = db['users']
-bookings_collection = db['bookings']
-payments_collection = db['payments']
+users_collection = InstrumentedCollection(db['users'])
+bookings_collection = InstrumentedCollection(db['bookings'])
+payments_collection = InstrumentedCollection(db['payments'])
+offers_collection = InstrumentedCollection(db['offers'])
+
+# Only the fields the booking endpoints serialize, not the price, segments or offer details
+BOOKING_PROJECTION = {
+    "user_id": 1,
+    "origin": 1,
+    "destination": 1,
+    "start_date": 1,
+    "end_date": 1,
+    "departure_date": 1,
+    "booking_date": 1
+}
+
+# Paging and streaming of the booking lists
+BOOKINGS_SORT = [("booking_date", ASCENDING), ("_id", ASCENDING)]
+BOOKINGS_PAGE_SIZE = int(os.getenv('BOOKINGS_PAGE_SIZE', 100))
+BOOKINGS_MAX_PAGE_SIZE = int(os.getenv('BOOKINGS_MAX_PAGE_SIZE', 1000))
+BOOKINGS_STREAM_BATCH_SIZE = int(os.getenv('BOOKINGS_STREAM_BATCH_SIZE', 500))
+
+
+def ensure_indexes():
+    # create_index is a no-op when the index already exists. Runs once per
+    # process before the first request (ensure_indexes_once), not on import.
+    try:
+        # Partial so that users registered without an email don't collide on null
+        users_collection.create_index(
+            [("email", ASCENDING)], unique=True, name="email_unique",
+            partialFilterExpression={"email": {"$type": "string"}}
+        )
+        # Also serves the keyset pagination of /get-bookings
+        bookings_collection.create_index(
+            [("user_id", ASCENDING), ("booking_date", ASCENDING), ("_id", ASCENDING)],
+            name="user_id_booking_date"
+        )
+        # /search-bookings pages by (booking_date, _id): equality, then the sort,
+        # then the date ranges, so a page reads only its own index entries
+        if "destination_start_date_end_date" in bookings_collection.index_information():
+            bookings_collection.drop_index("destination_start_date_end_date")
+        bookings_collection.create_index(
+            [("destination", ASCENDING), ("booking_date", ASCENDING), ("_id", ASCENDING),
+             ("start_date", ASCENDING), ("end_date", ASCENDING)],
+            name="destination_booking_date"
+        )
+        bookings_collection.create_index(
+            [("booking_date", ASCENDING), ("_id", ASCENDING), ("start_date", ASCENDING), ("end_date", ASCENDING)],
+            name="booking_date_id"
+        )
+        # Keys are scoped to the user; the earlier global index would make them collide
+        if "idempotency_key_unique" in payments_collection.index_information():
+            payments_collection.drop_index("idempotency_key_unique")
+        payments_collection.create_index(
+            [("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True,
+            name="user_id_idempotency_key_unique",
+            partialFilterExpression={"idempotency_key": {"$exists": True}}
+        )
+    except PyMongoError as e:
+        logging.warning("Failed to create MongoDB indexes: %s", e)
+
+
+def booking_response(booking):
+    return {
+        "booking_id": booking["_id"],
+        "user_id": booking["user_id"],
+        "origin": booking["origin"],
+        "destination": booking["destination"],
+        # Bookings made through /book-trip only have a departure date
+        "start_date": booking.get("start_date", booking.get("departure_date")),
+        "end_date": booking.get("end_date"),
+        "booking_date": booking["booking_date"]
+    }
 
 # Amadeus API credentials
 AMADEUS_API_KEY = os.getenv('AMADEUS_API_KEY')
@@ -30,32 +291,986 @@ AMADEUS_FLIGHT_OFFERS_URL = 'https://test.api.amadeus.com/v2/shopping/flight-off
 # Stripe API credentials
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
+# Outbound HTTP settings shared by the Amadeus and Stripe clients
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 20))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.25))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', 4))
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv('CIRCUIT_BREAKER_THRESHOLD', 5))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', 30))
+
+# Refresh the token this many seconds before Amadeus says it expires
+AMADEUS_TOKEN_REFRESH_MARGIN = int(os.getenv('AMADEUS_TOKEN_REFRESH_MARGIN', 60))
+
+# Flight offer cache settings
+FLIGHT_OFFER_CACHE_TTL = int(os.getenv('FLIGHT_OFFER_CACHE_TTL', 300))
+FLIGHT_OFFER_CACHE_MAX_ENTRIES = int(os.getenv('FLIGHT_OFFER_CACHE_MAX_ENTRIES', 256))
+FLIGHT_OFFER_CACHE_MAX_BYTES = int(os.getenv('FLIGHT_OFFER_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+FLIGHT_OFFER_CACHE_URL = os.getenv('FLIGHT_OFFER_CACHE_URL')
+# An unknown offer id only triggers a new search once the cached one is this old
+FLIGHT_OFFER_MIN_REFRESH_AGE = int(os.getenv('FLIGHT_OFFER_MIN_REFRESH_AGE', 60))
+
+# Offer tokens handed out by /search-flights; the secret must be shared by all workers
+OFFER_TOKEN_SECRET = os.getenv('OFFER_TOKEN_SECRET')
+if not OFFER_TOKEN_SECRET:
+    logging.warning("OFFER_TOKEN_SECRET is not set, offer tokens will only be accepted by this process")
+    OFFER_TOKEN_SECRET = os.urandom(32).hex()
+OFFER_INDEX_TTL = int(os.getenv('OFFER_INDEX_TTL', 900))
+OFFER_INDEX_MAX_ENTRIES = int(os.getenv('OFFER_INDEX_MAX_ENTRIES', 100000))
+
+# Flexible search fan-out limits
+FLEX_SEARCH_CONCURRENCY = int(os.getenv('FLEX_SEARCH_CONCURRENCY', 8))
+FLEX_SEARCH_MAX_WINDOW = int(os.getenv('FLEX_SEARCH_MAX_WINDOW', 7))
+FLEX_SEARCH_MAX_QUERIES = int(os.getenv('FLEX_SEARCH_MAX_QUERIES', 60))
+
+# Payment pipeline: "sync" creates the Stripe intent in the request, "async" queues it
+PAYMENT_MODE = os.getenv('PAYMENT_MODE', 'sync')
+PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', 4))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv('PAYMENT_MAX_ATTEMPTS', 3))
+
+
+class AmadeusAuthError(requests.exceptions.RequestException):
+    pass
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class OfferChangedError(ValueError):
+    pass
+
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream failures.
+
+    After ``threshold`` consecutive failures the circuit opens and calls are
+    rejected with CircuitOpenError for ``reset_timeout`` seconds. Then one
+    trial call is let through: success closes the circuit, failure opens it
+    again.
+    """
+
+    def __init__(self, name, threshold=CIRCUIT_BREAKER_THRESHOLD, reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"{self.name} circuit is open, failing fast")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logging.warning("%s circuit opened after %d failures", self.name, self._failures)
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def call(self, func, *args, failures=(Exception,), **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except failures:
+            self.record_failure()
+            raise
+        except Exception:
+            # Errors outside ``failures`` mean the upstream answered
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+
+class HttpClient:
+    """Pooled ``requests.Session`` with timeouts, retries and a circuit breaker.
+
+    429 and 5xx responses and connection errors are retried with jittered
+    exponential backoff (honouring Retry-After); a response that is still
+    failing after the retries counts against the circuit breaker.
+    """
+
+    def __init__(self, name, pool_size=HTTP_POOL_SIZE, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                 max_retries=HTTP_MAX_RETRIES, breaker=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker(name)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        operation = f"{method} {urlparse(url).path}"
+        with metrics.timed(self.name, operation):
+            response = self._request(method, url, **kwargs)
+        if response.status_code >= 500:
+            metrics.inc('dependency_errors_total', dependency=self.name, operation=operation)
+        return response
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        self.breaker.before_call()
+        try:
+            response = self._send(method, url, **kwargs)
+        except Exception:
+            # Every outcome has to be recorded, or a half-open trial never finishes
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _send(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt < self.max_retries:
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                raise
+            if response.status_code in HTTP_RETRY_STATUSES and attempt < self.max_retries:
+                self._backoff(attempt, response.headers.get('Retry-After'))
+                attempt += 1
+                response.close()
+                continue
+            return response
+
+    def _backoff(self, attempt, retry_after=None):
+        with self._lock:
+            self.retries += 1
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(HTTP_BACKOFF_MAX, float(retry_after)))
+        time.sleep(delay)
+
+
+amadeus_http = HttpClient('amadeus')
+stripe_http = HttpClient('stripe')
+
+# Route Stripe through the pooled session; the library retries with idempotency keys itself
+stripe.default_http_client = stripe.RequestsClient(session=stripe_http.session, timeout=HTTP_READ_TIMEOUT)
+stripe.max_network_retries = HTTP_MAX_RETRIES
+
+
+class AmadeusTokenManager:
+    """Process-wide cache for the Amadeus client-credentials token.
+
+    The token is reused until shortly before its ``expires_in``; inside the
+    refresh margin a single background thread fetches the next one while
+    callers keep using the current token. Only one caller refreshes at a
+    time, the rest wait for its result.
+    """
+
+    def __init__(self, refresh_margin=AMADEUS_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._refreshing = False
+        self.hits = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.failures = 0
+
+    def get_token(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if self._token and now < self._expires_at:
+                    self.hits += 1
+                    if now >= self._refresh_at and not self._refreshing:
+                        self._refreshing = True
+                        self.background_refreshes += 1
+                        threading.Thread(target=self._background_refresh, daemon=True).start()
+                    return self._token
+                if not self._refreshing:
+                    self._refreshing = True
+                    break
+                self._refreshed.wait()
+        return self._refresh()
+
+    def invalidate(self, token):
+        # Only drop the token the caller saw rejected, not a newer one
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+                self._refresh_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "background_refreshes": self.background_refreshes,
+                "failures": self.failures,
+                "expires_in": max(0, round(self._expires_at - time.monotonic())) if self._token else 0
+            }
+
+    def _fetch_token(self):
+        try:
+            auth_response = amadeus_http.post(AMADEUS_AUTH_URL, data={
+                'grant_type': 'client_credentials',
+                'client_id': AMADEUS_API_KEY,
+                'client_secret': AMADEUS_API_SECRET
+            })
+            auth_response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise AmadeusAuthError(str(e)) from e
+        payload = auth_response.json()
+        return payload['access_token'], int(payload.get('expires_in', 0))
+
+    def _refresh(self):
+        try:
+            token, expires_in = self._fetch_token()
+        except Exception:
+            with self._lock:
+                self.failures += 1
+                self._refreshing = False
+                self._refreshed.notify_all()
+            raise
+        with self._lock:
+            now = time.monotonic()
+            self._token = token
+            self._expires_at = now + expires_in
+            # Never schedule the refresh earlier than half the token lifetime
+            self._refresh_at = now + max(expires_in - self.refresh_margin, expires_in / 2)
+            self._refreshing = False
+            self.refreshes += 1
+            self._refreshed.notify_all()
+        return token
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            logging.warning("Background Amadeus token refresh failed: %s", e)
+
+
+amadeus_tokens = AmadeusTokenManager()
+
+
 def get_amadeus_token():
-    auth_response = requests.post(AMADEUS_AUTH_URL, data={
-        'grant_type': 'client_credentials',
-        'client_id': AMADEUS_API_KEY,
-        'client_secret': AMADEUS_API_SECRET
-    })
-    auth_response.raise_for_status()
-    return auth_response.json()['access_token']
-
-def validate_flight_offer(origin, destination, departure_date):
-    # Extract the date portion from the datetime string
-    departure_date = departure_date.split("T")[0]
-    
-    access_token = get_amadeus_token()
-    headers = {
+    return amadeus_tokens.get_token()
+
+
+def amadeus_get(url, params, access_token=None):
+    if access_token is None:
+        access_token = get_amadeus_token()
+    response = amadeus_http.get(url, headers=amadeus_headers(access_token), params=params)
+    if response.status_code == 401:
+        # Token was revoked or expired early, fetch a fresh one and retry once
+        amadeus_tokens.invalidate(access_token)
+        response = amadeus_http.get(url, headers=amadeus_headers(get_amadeus_token()), params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def amadeus_headers(access_token):
+    return {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
-    response = requests.get(AMADEUS_FLIGHT_OFFERS_URL, headers=headers, params={
-        'originLocationCode': origin,
-        'destinationLocationCode': destination,
-        'departureDate': departure_date,
-        'adults': 1
-    })
-    response.raise_for_status()
-    return response.json()
+
+
+class DictCacheBackend:
+    """In-memory stand-in for the shared cache backend (same get/set as Redis)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ex, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+def make_shared_cache_backend(url):
+    if not url:
+        return None
+    if url == 'memory://':
+        return DictCacheBackend()
+    import redis
+    return redis.Redis.from_url(url)
+
+
+class _PendingFetch:
+    def __init__(self):
+        self._done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def resolve(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class FlightOfferCache:
+    """Bounded TTL/LRU cache of Amadeus flight-offer search results.
+
+    Entries are evicted least-recently-used first once either the entry
+    count or the total serialized size goes over its limit. Concurrent
+    lookups for the same key while it is being fetched wait for the one
+    upstream call instead of making their own. When a shared backend is
+    configured it is consulted before going upstream and written after.
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, ttl=FLIGHT_OFFER_CACHE_TTL, max_entries=FLIGHT_OFFER_CACHE_MAX_ENTRIES,
+                 max_bytes=FLIGHT_OFFER_CACHE_MAX_BYTES, shared=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(origin, destination, departure_date, adults=1):
+        return (origin.strip().upper(), destination.strip().upper(), departure_date.split("T")[0], int(adults))
+
+    def get(self, key):
+        with self._lock:
+            return self._get_fresh(key)
+
+    def age(self, key):
+        # Seconds since the entry was stored, None when it is not cached
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return time.monotonic() - (entry[0] - self.ttl)
+
+    def get_or_fetch(self, key, fetch):
+        with self._lock:
+            value = self._get_fresh(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if not leader:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                pending = self._inflight[key] = _PendingFetch()
+        if not leader:
+            return pending.wait()
+
+        try:
+            value, raw = self._get_shared(key), None
+            if value is None:
+                value = fetch()
+                raw = self._set_shared(key, value)
+            else:
+                with self._lock:
+                    self.shared_hits += 1
+            self._store(key, value, raw)
+        except Exception as e:
+            pending.resolve(error=e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        pending.resolve(value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._drop(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(self._shared_key(key))
+            except Exception as e:
+                logging.warning("Shared flight offer cache delete failed: %s", e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions
+            }
+
+    def _get_fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def _store(self, key, value, raw=None):
+        size = len(raw if raw is not None else json.dumps(value).encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    @staticmethod
+    def _shared_key(key):
+        return 'flight-offers:' + ':'.join(str(part) for part in key)
+
+    def _get_shared(self, key):
+        if self.shared is None:
+            return None
+        try:
+            raw = self.shared.get(self._shared_key(key))
+        except Exception as e:
+            logging.warning("Shared flight offer cache read failed: %s", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def _set_shared(self, key, value):
+        if self.shared is None:
+            return None
+        raw = json.dumps(value).encode()
+        try:
+            self.shared.set(self._shared_key(key), raw, ex=self.ttl)
+        except Exception as e:
+            logging.warning("Shared flight offer cache write failed: %s", e)
+        return raw
+
+
+flight_offer_cache = FlightOfferCache(shared=make_shared_cache_backend(FLIGHT_OFFER_CACHE_URL))
+
+
+class OfferIndex:
+    """Short-lived map from offer token to a compact snapshot of the offer.
+
+    The raw offer is kept next to the snapshot, so a booking made after the
+    search cache expired can still store it without searching again.
+    """
+
+    def __init__(self, ttl=OFFER_INDEX_TTL, max_entries=OFFER_INDEX_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or time.monotonic() >= entry[0]:
+                self._entries.pop(token, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, token, snapshot, offer=None):
+        with self._lock:
+            self._entries.pop(token, None)
+            self._entries[token] = (time.monotonic() + self.ttl, snapshot, offer)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+offer_index = OfferIndex()
+offer_token_serializer = URLSafeSerializer(OFFER_TOKEN_SECRET, salt='flight-offer')
+
+
+def make_offer_token(key, snapshot):
+    return offer_token_serializer.dumps([*key, snapshot["id"], snapshot_digest(snapshot)])
+
+
+def load_offer_token(token):
+    # Returns (search key, offer id, snapshot digest) or raises BadSignature
+    *key, offer_id, digest = offer_token_serializer.loads(token)
+    return FlightOfferCache.make_key(*key), offer_id, digest
+
+
+def snapshot_digest(snapshot):
+    # Amadeus ids are positions in the response, the digest pins the offer behind one
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:16]
+
+
+def offer_snapshot(offer):
+    segments = [{
+        "carrier": segment.get('carrierCode'),
+        "number": segment.get('number'),
+        "departure": segment.get('departure', {}).get('iataCode'),
+        "departure_at": segment.get('departure', {}).get('at'),
+        "arrival": segment.get('arrival', {}).get('iataCode'),
+        "arrival_at": segment.get('arrival', {}).get('at')
+    } for itinerary in offer.get('itineraries', []) for segment in itinerary.get('segments', [])]
+    carriers = offer.get('validatingAirlineCodes') or [segment["carrier"] for segment in segments[:1]]
+    return {
+        "id": offer['id'],
+        "price": {
+            "total": offer.get('price', {}).get('total'),
+            "currency": offer.get('price', {}).get('currency')
+        },
+        "carrier": carriers[0] if carriers else None,
+        "segments": segments
+    }
+
+
+def index_flight_offers(key, flight_offers):
+    # Tag every offer with its token and remember a compact snapshot of it
+    for offer in flight_offers.get('data', []):
+        snapshot = offer_snapshot(offer)
+        offer['offer_token'] = make_offer_token(key, snapshot)
+        offer_index.put(offer['offer_token'], snapshot, offer)
+    return flight_offers
+
+
+def search_flight_offers(origin, destination, departure_date, adults=1):
+    key = FlightOfferCache.make_key(origin, destination, departure_date, adults)
+    return flight_offer_cache.get_or_fetch(key, lambda: index_flight_offers(key, amadeus_get(AMADEUS_FLIGHT_OFFERS_URL, {
+        'originLocationCode': key[0],
+        'destinationLocationCode': key[1],
+        'departureDate': key[2],
+        'adults': key[3]
+    })))
+
+
+def find_flight_offer(flight_offers, flight_offer_id):
+    for offer in flight_offers.get('data', []):
+        if offer['id'] == flight_offer_id:
+            return offer
+    return None
+
+
+def validate_flight_offer(origin, destination, departure_date, flight_offer_id):
+    # Look in the cached search first. Re-search only if that search is old
+    # enough to be stale, so unknown ids can't keep evicting the route.
+    valid_offer = find_flight_offer(search_flight_offers(origin, destination, departure_date), flight_offer_id)
+    key = FlightOfferCache.make_key(origin, destination, departure_date)
+    if valid_offer is None and (flight_offer_cache.age(key) or 0) >= FLIGHT_OFFER_MIN_REFRESH_AGE:
+        flight_offer_cache.invalidate(key)
+        valid_offer = find_flight_offer(search_flight_offers(origin, destination, departure_date), flight_offer_id)
+    return valid_offer
+
+
+def resolve_offer_token(token):
+    # The raw offer when it is still indexed, otherwise its snapshot
+    entry = offer_index.get(token)
+    if entry is not None:
+        snapshot, offer = entry
+        return offer or snapshot
+    # Snapshot expired or was made by another worker, fall back to the search
+    # and only accept the offer the token was issued for
+    key, offer_id, digest = load_offer_token(token)
+    offer = validate_flight_offer(key[0], key[1], key[2], offer_id)
+    if offer is None:
+        return None
+    snapshot = offer_snapshot(offer)
+    if snapshot_digest(snapshot) != digest:
+        raise OfferChangedError("The flight offer has changed since the search, search again")
+    offer_index.put(token, snapshot, offer)
+    return offer
+
+
+def store_offer(offer):
+    """Store a raw Amadeus offer once, keyed by the SHA-256 of its content."""
+    payload = {k: v for k, v in offer.items() if k != 'offer_token'}
+    offer_hash = hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+    try:
+        offers_collection.update_one({"_id": offer_hash}, {"$setOnInsert": {
+            "payload": payload,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }}, upsert=True)
+    except DuplicateKeyError:
+        # Another booking stored the same offer at the same time
+        pass
+    return offer_hash
+
+
+def booking_offer_fields(offer):
+    """Typed top-level booking fields for a full offer or an offer snapshot.
+
+    Full offers are also stored in the offers collection and referenced by
+    ``offer_hash``; for a snapshot the raw payload is not known.
+    """
+    snapshot = offer if 'segments' in offer else offer_snapshot(offer)
+    segments = snapshot["segments"]
+    total = snapshot["price"]["total"]
+    return {
+        "price": float(total) if total is not None else None,
+        "currency": snapshot["price"]["currency"],
+        "carrier": snapshot["carrier"],
+        "segments": segments,
+        "departure_at": segments[0]["departure_at"] if segments else None,
+        "arrival_at": segments[-1]["arrival_at"] if segments else None,
+        "offer_hash": store_offer(offer) if 'itineraries' in offer else None
+    }
+
+
+def lowest_fare(flight_offers):
+    offers = [offer for offer in flight_offers.get('data', []) if offer.get('price', {}).get('total')]
+    if not offers:
+        return None
+    offer = min(offers, key=lambda offer: float(offer['price']['total']))
+    return {
+        "total": offer['price']['total'],
+        "currency": offer['price'].get('currency'),
+        "offer_token": offer.get('offer_token')
+    }
+
+
+async def flex_search(routes, dates, concurrency=FLEX_SEARCH_CONCURRENCY):
+    """Lowest fare for every (route, date), searched concurrently.
+
+    The searches run on worker threads through search_flight_offers, so they
+    share the Amadeus token, the offer cache and the pooled HTTP client.
+    The threads are a pool of ``concurrency`` of their own; the loop's default
+    executor can be smaller than that on small machines.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def search(executor, origin, destination, departure_date):
+        try:
+            flight_offers = await loop.run_in_executor(executor, search_flight_offers, origin, destination, departure_date)
+            fare = lowest_fare(flight_offers)
+        except Exception as e:
+            # One failed search (open circuit, bad payload, ...) must not fail the whole matrix
+            return origin, destination, departure_date, None, str(e) or type(e).__name__
+        return origin, destination, departure_date, fare, None
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='flex-search') as executor:
+        results = await asyncio.gather(*[search(executor, origin, destination, departure_date)
+                                         for origin, destination in routes for departure_date in dates])
+    matrix = {(origin, destination): {departure_date: None for departure_date in dates} for origin, destination in routes}
+    errors = []
+    for origin, destination, departure_date, fare, error in results:
+        matrix[(origin, destination)][departure_date] = fare
+        if error:
+            errors.append({"origin": origin, "destination": destination, "date": departure_date, "error": error})
+    return {
+        "dates": dates,
+        "routes": [{"origin": origin, "destination": destination, "fares": fares}
+                   for (origin, destination), fares in matrix.items()],
+        "errors": errors
+    }
+
+
+payment_executor = ThreadPoolExecutor(max_workers=PAYMENT_WORKERS, thread_name_prefix='payment')
+
+
+def create_payment_intent(amount, idempotency_key=None):
+    options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+    with metrics.timed('stripe', 'PaymentIntent.create'):
+        return stripe_http.breaker.call(
+            stripe.PaymentIntent.create,
+            amount=int(amount * 100),  # amount in cents
+            currency='usd',
+            metadata={'integration_check': 'accept_a_payment'},
+            failures=(stripe.error.APIConnectionError, stripe.error.APIError),
+            **options
+        )
+
+
+def create_queued_payment_intent(payment):
+    # Transient Stripe failures are retried with backoff, anything else fails at once
+    attempts = max(1, PAYMENT_MAX_ATTEMPTS)
+    for attempt in range(attempts):
+        try:
+            return create_payment_intent(payment["amount"], payment["_id"])
+        except (CircuitOpenError, stripe.error.APIConnectionError, stripe.error.APIError):
+            if attempt + 1 == attempts:
+                raise
+            time.sleep(HTTP_BACKOFF_BASE * 2 ** attempt)
+
+
+def process_payment(payment_id):
+    """Create the Stripe intent for a queued payment and record the outcome.
+
+    The payment id is passed to Stripe as idempotency key, so running this
+    twice for the same payment (a retry, or a resumed queue) creates one intent.
+    Any error marks the payment failed rather than leaving it pending.
+    """
+    try:
+        payment = payments_collection.find_one({"_id": payment_id, "status": "pending"},
+                                               {"amount": 1})
+        if not payment:
+            return
+        intent = create_queued_payment_intent(payment)
+        payments_collection.update_one({"_id": payment_id}, {"$set": {
+            "status": "created",
+            "stripe_payment_intent_id": intent['id'],
+            "client_secret": intent['client_secret']
+        }})
+    except Exception as e:
+        try:
+            payments_collection.update_one({"_id": payment_id, "status": "pending"},
+                                           {"$set": {"status": "failed", "error": str(e)}})
+        except PyMongoError as mongo_error:
+            logging.error("Failed to mark payment %s as failed: %s", payment_id, mongo_error)
+        raise
+
+
+def queue_payment(payment_id):
+    payment_executor.submit(process_payment, payment_id).add_done_callback(log_payment_error)
+
+
+def log_payment_error(future):
+    if future.exception() is not None:
+        logging.error("Queued payment failed: %s", future.exception())
+
+
+def resume_pending_payments():
+    # Payments queued by a process that stopped before handling them
+    # (`flask --app app resume-payments` once per deployment, not on import)
+    try:
+        for payment in payments_collection.find({"status": "pending"}, {"_id": 1}):
+            queue_payment(payment["_id"])
+    except PyMongoError as e:
+        logging.warning("Failed to resume pending payments: %s", e)
+
+
+def dump_bookings_cursor(booking):
+    # The keyset values aren't secret, plain base64 JSON works across workers and restarts
+    return base64.urlsafe_b64encode(json.dumps([booking["booking_date"], booking["_id"]]).encode()).decode()
+
+
+def bookings_after(next_cursor):
+    # Keyset condition for everything sorted after the last booking of the previous page
+    booking_date, booking_id = json.loads(base64.urlsafe_b64decode(next_cursor.encode()))
+    if not isinstance(booking_date, str) or not isinstance(booking_id, str):
+        raise ValueError(next_cursor)
+    return {"$or": [
+        {"booking_date": {"$gt": booking_date}},
+        {"booking_date": booking_date, "_id": {"$gt": booking_id}}
+    ]}
+
+
+def stream_bookings(cursor, ndjson):
+    # Closed when the client goes away mid-stream too
+    try:
+        if ndjson:
+            for booking in cursor:
+                yield app.json.dumps(booking_response(booking)) + "\n"
+            return
+        yield "["
+        separator = ""
+        for booking in cursor:
+            yield separator + app.json.dumps(booking_response(booking))
+            separator = ","
+        yield "]"
+    finally:
+        cursor.close()
+
+
+def list_bookings(query):
+    """Serve a booking query as a plain list, a keyset page or a stream.
+
+    ``limit``/``cursor`` return ``{"bookings": [...], "next_cursor": ...}``
+    ordered by booking date; ``stream=ndjson`` or ``stream=json`` stream all
+    rows straight from the Mongo cursor and can't be combined with paging.
+    Without either the full list is returned as before.
+    """
+    stream = request.args.get("stream")
+    paginated = "limit" in request.args or "cursor" in request.args
+    try:
+        limit = int(request.args.get("limit", BOOKINGS_PAGE_SIZE if paginated else 0))
+        if limit < (1 if paginated else 0):
+            raise ValueError(limit)
+        if "cursor" in request.args:
+            query = {"$and": [query, bookings_after(request.args["cursor"])]}
+    except (ValueError, TypeError):
+        return jsonify({"message": "Invalid limit or cursor"}), 400
+    if stream not in (None, "ndjson", "json"):
+        return jsonify({"message": "stream must be ndjson or json"}), 400
+    if stream and paginated:
+        return jsonify({"message": "stream can't be combined with limit or cursor"}), 400
+
+    if stream:
+        cursor = bookings_collection.find(query, BOOKING_PROJECTION).batch_size(BOOKINGS_STREAM_BATCH_SIZE)
+        return Response(stream_with_context(stream_bookings(cursor, stream == "ndjson")),
+                        mimetype="application/x-ndjson" if stream == "ndjson" else "application/json")
+
+    if not paginated:
+        return jsonify([booking_response(booking) for booking in bookings_collection.find(query, BOOKING_PROJECTION)]), 200
+
+    limit = min(limit, BOOKINGS_MAX_PAGE_SIZE)
+    # Fetch one extra row to know whether there is a next page
+    page = list(bookings_collection.find(query, BOOKING_PROJECTION).sort(BOOKINGS_SORT).limit(limit + 1))
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = dump_bookings_cursor(page[-1])
+    return jsonify({"bookings": [booking_response(booking) for booking in page], "next_cursor": next_cursor}), 200
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread every ``interval`` seconds.
+
+    ``collapsed()`` returns the samples in the folded format read by
+    flamegraph tools.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+indexes_ensured = False
+indexes_lock = threading.Lock()
+
+
+@app.before_request
+def ensure_indexes_once():
+    # Every worker creates the indexes it depends on before serving
+    global indexes_ensured
+    if indexes_ensured:
+        return
+    with indexes_lock:
+        if not indexes_ensured:
+            ensure_indexes()
+            indexes_ensured = True
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    # Profiling has to be enabled on the server and asked for by the client
+    if PROFILING_ENABLED and request.headers.get("X-Profile") == "1":
+        g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if "request_started" in g:
+        # Streamed responses are timed up to the first byte
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - g.request_started,
+                        route=route, method=request.method, status=response.status_code)
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        response.headers["X-Profile-Samples"] = str(sum(profiler.stacks.values()))
+        if PROFILE_DIR:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route.strip('/').replace('/', '_') or 'root'}-{uuid.uuid4().hex[:8]}.folded"
+            with open(os.path.join(PROFILE_DIR, name), "w") as profile_file:
+                profile_file.write(profiler.collapsed())
+        else:
+            logging.info("Profile for %s %s:\n%s", request.method, request.path, profiler.collapsed())
+    return response
 
 
 @app.route("/register", methods=["POST"])
@@ -68,7 +1283,10 @@ def register():
         "email": data.get("email"),
         "password": data.get("password")
     }
-    users_collection.insert_one(new_user)
+    try:
+        users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        return jsonify({"message": "Email already registered"}), 409
     return jsonify({"message": "User registered successfully", "user_id": user_id}), 201
 
 @app.route("/login", methods=["POST"])
@@ -76,7 +1294,7 @@ def login():
     data = request.get_json()
     email = data.get("email")
     password = data.get("password")
-    user = users_collection.find_one({"email": email, "password": password})
+    user = users_collection.find_one({"email": email, "password": password}, {"_id": 1})
     if user:
         return jsonify({"message": "Login successful", "user_id": user["_id"]}), 200
     return jsonify({"message": "Invalid credentials"}), 401
@@ -87,22 +1305,33 @@ def book_trip():
     booking_id = str(uuid.uuid4())
     user_id = data.get("user_id")
     flight_offer_id = data.get("flight_offer_id")
-    origin = data.get("origin")
-    destination = data.get("destination")
-    departure_date = data.get("start_date").split("T")[0]
-    if not users_collection.find_one({"_id": user_id}):
+    offer_token = data.get("offer_token")
+    if not users_collection.find_one({"_id": user_id}, {"_id": 1}):
         return jsonify({"message": "User not found"}), 404
 
+    if offer_token is not None and not isinstance(offer_token, str):
+        return jsonify({"message": "Invalid offer token"}), 400
+    if offer_token:
+        try:
+            key, flight_offer_id, _ = load_offer_token(offer_token)
+        except (BadSignature, TypeError, ValueError):
+            return jsonify({"message": "Invalid offer token"}), 400
+        origin, destination, departure_date = key[0], key[1], key[2]
+    else:
+        origin = data.get("origin")
+        destination = data.get("destination")
+        departure_date = data.get("start_date").split("T")[0]
+
     # Validate flight offer
     try:
-        flight_offers = validate_flight_offer(origin, destination, departure_date)
-        valid_offer = None
-        for offer in flight_offers['data']:
-            if offer['id'] == flight_offer_id:
-                valid_offer = offer
-                break
+        if offer_token:
+            valid_offer = resolve_offer_token(offer_token)
+        else:
+            valid_offer = validate_flight_offer(origin, destination, departure_date, flight_offer_id)
         if not valid_offer:
             return jsonify({"message": "No valid flight offer found for the provided ID"}), 400
+    except OfferChangedError as e:
+        return jsonify({"message": str(e)}), 409
     except Exception as e:
         return jsonify({"message": "Error validating flight offer", "error": str(e)}), 400
     
@@ -113,29 +1342,19 @@ def book_trip():
         "origin": origin,
         "destination": destination,
         "departure_date": departure_date,
-        "booking_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "flight_details": valid_offer
+        "booking_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
+    new_booking.update(booking_offer_fields(valid_offer))
     bookings_collection.insert_one(new_booking)
     return jsonify({"message": "Trip booked successfully", "booking_id": booking_id}), 201
 
 
 @app.route("/get-bookings/<user_id>", methods=["GET"])
 def get_bookings(user_id):
-    if not users_collection.find_one({"_id": user_id}):
+    if not users_collection.find_one({"_id": user_id}, {"_id": 1}):
         return jsonify({"message": "User not found"}), 404
     
-    user_bookings = bookings_collection.find({"user_id": user_id})
-    bookings_list = [{
-        "booking_id": booking["_id"],
-        "user_id": booking["user_id"],
-        "origin": booking["origin"],
-        "destination": booking["destination"],
-        "start_date": booking["start_date"],
-        "end_date": booking["end_date"],
-        "booking_date": booking["booking_date"]
-    } for booking in user_bookings]
-    return jsonify(bookings_list), 200
+    return list_bookings({"user_id": user_id})
 
 @app.route("/cancel-booking/<booking_id>", methods=["DELETE"])
 def cancel_booking(booking_id):
@@ -159,21 +1378,11 @@ def search_bookings():
     if end_date:
         query["end_date"] = {"$lte": end_date}
     
-    filtered_bookings = bookings_collection.find(query)
-    bookings_list = [{
-        "booking_id": booking["_id"],
-        "user_id": booking["user_id"],
-        "origin": booking["origin"],
-        "destination": booking["destination"],
-        "start_date": booking["start_date"],
-        "end_date": booking["end_date"],
-        "booking_date": booking["booking_date"]
-    } for booking in filtered_bookings]
-    return jsonify(bookings_list), 200
+    return list_bookings(query)
 
 @app.route("/update-booking/<booking_id>", methods=["PUT"])
 def update_booking(booking_id):
-    booking = bookings_collection.find_one({"_id": booking_id})
+    booking = bookings_collection.find_one({"_id": booking_id}, BOOKING_PROJECTION)
     if not booking:
         return jsonify({"message": "Booking not found"}), 404
 
@@ -181,21 +1390,13 @@ def update_booking(booking_id):
     update_fields = {
         "origin": data.get("origin", booking["origin"]),
         "destination": data.get("destination", booking["destination"]),
-        "start_date": data.get("start_date", booking["start_date"]),
-        "end_date": data.get("end_date", booking["end_date"])
+        "start_date": data.get("start_date", booking.get("start_date", booking.get("departure_date"))),
+        "end_date": data.get("end_date", booking.get("end_date"))
     }
     bookings_collection.update_one({"_id": booking_id}, {"$set": update_fields})
     
-    updated_booking = bookings_collection.find_one({"_id": booking_id})
-    return jsonify({"message": "Booking updated successfully", "booking": {
-        "booking_id": updated_booking["_id"],
-        "user_id": updated_booking["user_id"],
-        "origin": updated_booking["origin"],
-        "destination": updated_booking["destination"],
-        "start_date": updated_booking["start_date"],
-        "end_date": updated_booking["end_date"],
-        "booking_date": updated_booking["booking_date"]
-    }}), 200
+    updated_booking = bookings_collection.find_one({"_id": booking_id}, BOOKING_PROJECTION)
+    return jsonify({"message": "Booking updated successfully", "booking": booking_response(updated_booking)}), 200
 
 @app.route("/make-payment", methods=["POST"])
 def make_payment():
@@ -205,26 +1406,31 @@ def make_payment():
     booking_id = data.get("booking_id")
     amount = data.get("amount")
 
-    if not users_collection.find_one({"_id": user_id}):
+    if not users_collection.find_one({"_id": user_id}, {"_id": 1}):
         return jsonify({"message": "User not found"}), 404
-    booking = bookings_collection.find_one({"_id": booking_id})
+    booking = bookings_collection.find_one({"_id": booking_id}, {"price": 1, "flight_details.price.total": 1})
     if not booking:
         return jsonify({"message": "Booking not found"}), 404
     
-    # Get the price of the ticket from the flight details
-    ticket_price = booking["flight_details"]["price"]["total"]
+    # Get the price of the ticket, bookings not migrated yet still embed the flight details
+    if "price" in booking:
+        ticket_price = booking["price"]
+    else:
+        ticket_price = booking["flight_details"]["price"]["total"]
     ticket_price = float(ticket_price)
 
     # Check if the amount is enough to cover the ticket price
     if amount < ticket_price:
         return jsonify({"message": "Amount is not enough to cover the ticket price"}), 400
 
+    if data.get("mode", PAYMENT_MODE) == "async":
+        return queue_make_payment(data, payment_id, user_id, booking_id, amount)
+
     # Create Stripe Payment Intent
-    intent = stripe.PaymentIntent.create(
-        amount=int(amount * 100),  # amount in cents
-        currency='usd',
-        metadata={'integration_check': 'accept_a_payment'},
-    )
+    try:
+        intent = create_payment_intent(amount)
+    except CircuitOpenError as e:
+        return jsonify({"message": "Payment provider unavailable", "error": str(e)}), 503
 
     new_payment = {
         "_id": payment_id,
@@ -237,6 +1443,44 @@ def make_payment():
     payments_collection.insert_one(new_payment)
     return jsonify({"message": "Payment successful", "payment_id": payment_id, "client_secret": intent['client_secret']}), 201
 
+def queue_make_payment(data, payment_id, user_id, booking_id, amount):
+    idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key") or payment_id
+    new_payment = {
+        "_id": payment_id,
+        "user_id": user_id,
+        "booking_id": booking_id,
+        "amount": amount,
+        "payment_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "status": "pending",
+        "idempotency_key": idempotency_key
+    }
+    # Upsert on the key so a retried request finds the first payment even
+    # without the unique index, which only has to settle concurrent inserts
+    key_filter = {"user_id": user_id, "idempotency_key": idempotency_key}
+    try:
+        inserted = payments_collection.update_one(key_filter, {"$setOnInsert": new_payment}, upsert=True).upserted_id
+    except DuplicateKeyError:
+        inserted = None
+    if inserted is None:
+        existing = payments_collection.find_one(key_filter, {"status": 1})
+        return jsonify({"message": "Payment already queued", "payment_id": existing["_id"], "status": existing["status"]}), 200
+    queue_payment(payment_id)
+    return jsonify({"message": "Payment queued", "payment_id": payment_id, "status": "pending"}), 202
+
+@app.route("/payment-status/<payment_id>", methods=["GET"])
+def payment_status(payment_id):
+    payment = payments_collection.find_one({"_id": payment_id},
+                                           {"status": 1, "client_secret": 1, "error": 1, "stripe_payment_intent_id": 1})
+    if not payment:
+        return jsonify({"message": "Payment not found"}), 404
+    # Payments made in sync mode have no status field and were created in the request
+    status = payment.get("status", "created")
+    response = {"payment_id": payment_id, "status": status}
+    if status == "created" and "client_secret" in payment:
+        response["client_secret"] = payment["client_secret"]
+    if status == "failed":
+        response["error"] = payment.get("error")
+    return jsonify(response), 200
 
 
 @app.route("/search-flights", methods=["GET"])
@@ -248,41 +1492,103 @@ def search_flights():
     if not origin or not destination or not departure_date:
         return jsonify({"message": "Missing required parameters"}), 400
     
-    # Get Amadeus Access Token
     try:
-        auth_response = requests.post(AMADEUS_AUTH_URL, data={
-            'grant_type': 'client_credentials',
-            'client_id': AMADEUS_API_KEY,
-            'client_secret': AMADEUS_API_SECRET
-        })
-        auth_response.raise_for_status()
-        access_token = auth_response.json()['access_token']
-    except requests.exceptions.RequestException as e:
+        flight_offers = search_flight_offers(origin, destination, departure_date)
+    except AmadeusAuthError as e:
         return jsonify({"message": "Failed to get Amadeus access token", "error": str(e)}), 500
-    
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    try:
-        flight_response = requests.get(AMADEUS_FLIGHT_OFFERS_URL, headers=headers, params={
-            'originLocationCode': origin,
-            'destinationLocationCode': destination,
-            'departureDate': departure_date,
-            'adults': 1
-        })
-        flight_response.raise_for_status()
-        flight_offers = flight_response.json()
     except requests.exceptions.RequestException as e:
         return jsonify({"message": "Failed to get flight offers from Amadeus", "error": str(e)}), 500
     
     return jsonify(flight_offers), 200
 
 
+@app.route("/search-flights/flex", methods=["GET"])
+def search_flights_flex():
+    # routes=JFK-LAX,JFK-SFO or origin/destination; window is +/- days around departure_date
+    departure_date = request.args.get("departure_date")
+    if request.args.get("routes"):
+        routes = [tuple(route.strip().upper().split("-", 1)) for route in request.args["routes"].split(",")]
+    else:
+        routes = [(request.args.get("origin", "").upper(), request.args.get("destination", "").upper())]
+    routes = list(dict.fromkeys(routes))
+    if not departure_date or any(len(route) != 2 or not all(route) for route in routes):
+        return jsonify({"message": "Missing required parameters"}), 400
+
+    try:
+        center = datetime.strptime(departure_date.split("T")[0], "%Y-%m-%d").date()
+        window = int(request.args.get("window", 0))
+    except ValueError:
+        return jsonify({"message": "Invalid departure_date or window"}), 400
+    if not 0 <= window <= FLEX_SEARCH_MAX_WINDOW:
+        return jsonify({"message": f"window must be between 0 and {FLEX_SEARCH_MAX_WINDOW}"}), 400
+
+    today = datetime.now().date()
+    dates = [(center + timedelta(days=offset)).isoformat() for offset in range(-window, window + 1)
+             if center + timedelta(days=offset) >= today]
+    if not dates:
+        return jsonify({"message": "No departure dates left in the window"}), 400
+    if len(routes) * len(dates) > FLEX_SEARCH_MAX_QUERIES:
+        return jsonify({"message": f"Too many searches, at most {FLEX_SEARCH_MAX_QUERIES} route/date pairs"}), 400
+
+    try:
+        # Fail once up front instead of once per search if Amadeus auth is down
+        get_amadeus_token()
+    except requests.exceptions.RequestException as e:
+        return jsonify({"message": "Failed to get Amadeus access token", "error": str(e)}), 500
+
+    return jsonify(asyncio.run(flex_search(routes, dates))), 200
+
+
+@app.route("/amadeus-token-stats", methods=["GET"])
+def amadeus_token_stats():
+    return jsonify(amadeus_tokens.stats()), 200
+
+@app.route("/flight-offer-cache-stats", methods=["GET"])
+def flight_offer_cache_stats():
+    return jsonify({**flight_offer_cache.stats(), "offer_index": offer_index.stats()}), 200
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    offer_cache = flight_offer_cache.stats()
+    tokens = amadeus_tokens.stats()
+    index = offer_index.stats()
+    caches = {
+        "flight_offers": (offer_cache["hits"] + offer_cache["shared_hits"] + offer_cache["coalesced"], offer_cache["misses"]),
+        "amadeus_token": (tokens["hits"], tokens["refreshes"]),
+        "offer_index": (index["hits"], index["misses"])
+    }
+    counters = [
+        ("cache_hits_total", "Cache hits since start.", [({"cache": name}, hits) for name, (hits, _) in caches.items()]),
+        ("cache_misses_total", "Cache misses since start.", [({"cache": name}, misses) for name, (_, misses) in caches.items()]),
+        ("http_client_retries_total", "Retried outbound HTTP calls since start.",
+         [({"dependency": http.name}, http.retries) for http in (amadeus_http, stripe_http)])
+    ]
+    gauges = [
+        ("cache_hit_ratio", "Share of cache lookups answered without the upstream.",
+         [({"cache": name}, round(hits / (hits + misses), 4) if hits + misses else 0) for name, (hits, misses) in caches.items()]),
+        ("cache_entries", "Entries currently cached.", [({"cache": "flight_offers"}, offer_cache["entries"]),
+                                                       ({"cache": "offer_index"}, index["entries"])]),
+        ("circuit_breaker_open", "1 while the circuit breaker rejects calls.",
+         [({"dependency": breaker.name}, int(breaker.state != "closed")) for breaker in (amadeus_http.breaker, stripe_http.breaker)])
+    ]
+    return Response(metrics.render(gauges, counters), mimetype="text/plain; version=0.0.4")
+
+
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    ensure_indexes()
 
 
+@app.cli.command("resume-payments")
+def resume_payments_command():
+    # Run once per deployment, not in every worker, so each pending payment is queued once
+    resume_pending_payments()
+    payment_executor.shutdown(wait=True)
 
 
 if __name__ == "__main__":
+    # The debug reloader runs this file twice, only the serving child resumes payments
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        resume_pending_payments()
     app.run(debug=True)
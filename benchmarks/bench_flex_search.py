@@ -0,0 +1,69 @@
+"""Compare a serial run of /search-flights over a date window with a single
+/search-flights/flex call, against a stub Amadeus with fixed latency.
+
+    python benchmarks/bench_flex_search.py --latency 0.3 --window 3 --routes JFK-LAX,JFK-SFO
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as travel_app  # noqa: E402
+from stubs import StubAmadeusServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.3, help="stub latency per upstream call in seconds")
+    parser.add_argument("--window", type=int, default=3)
+    parser.add_argument("--routes", default="JFK-LAX")
+    args = parser.parse_args()
+
+    routes = [route.split("-") for route in args.routes.split(",")]
+    center = date.today() + timedelta(days=30)
+    dates = [(center + timedelta(days=offset)).isoformat() for offset in range(-args.window, args.window + 1)]
+
+    with StubAmadeusServer(latency=args.latency) as stub:
+        travel_app.AMADEUS_AUTH_URL = stub.url + "/v1/security/oauth2/token"
+        travel_app.AMADEUS_FLIGHT_OFFERS_URL = stub.url + "/v2/shopping/flight-offers"
+        travel_app.get_amadeus_token()
+        # Nothing here touches Mongo, don't wait for one on the first request
+        travel_app.indexes_ensured = True
+        client = travel_app.app.test_client()
+
+        travel_app.flight_offer_cache = travel_app.FlightOfferCache()
+        started = time.perf_counter()
+        for origin, destination in routes:
+            for departure_date in dates:
+                response = client.get("/search-flights", query_string={
+                    "origin": origin, "destination": destination, "departure_date": departure_date})
+                assert response.status_code == 200, response.get_json()
+        serial_seconds = time.perf_counter() - started
+
+        travel_app.flight_offer_cache = travel_app.FlightOfferCache()
+        searches_before = stub.count("/v2/shopping/flight-offers")
+        started = time.perf_counter()
+        response = client.get("/search-flights/flex", query_string={
+            "routes": args.routes, "departure_date": center.isoformat(), "window": args.window})
+        flex_seconds = time.perf_counter() - started
+        assert response.status_code == 200, response.get_json()
+        flex = response.get_json()
+
+    print(json.dumps({
+        "latency_s": args.latency,
+        "searches": len(routes) * len(dates),
+        "concurrency": travel_app.FLEX_SEARCH_CONCURRENCY,
+        "serial_s": round(serial_seconds, 3),
+        "flex_s": round(flex_seconds, 3),
+        "speedup": round(serial_seconds / flex_seconds, 1),
+        "flex_upstream_calls": stub.count("/v2/shopping/flight-offers") - searches_before,
+        "flex_errors": flex["errors"]
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
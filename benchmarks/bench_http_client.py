@@ -0,0 +1,94 @@
+"""Check the pooled HttpClient against a local stub server and measure what
+connection reuse saves compared to bare ``requests.get``.
+
+    python benchmarks/bench_http_client.py --requests 500
+
+Prints a JSON report and exits non-zero if connections are not reused, a
+retried request does not succeed, or the circuit breaker does not open.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import app as travel_app  # noqa: E402
+from stubs import StubAmadeusServer  # noqa: E402
+
+
+def timed_requests(get, url, count):
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        get(url).raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summary(samples, connections):
+    return {
+        "requests": len(samples),
+        "connections": connections,
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(statistics.median(samples), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    failures = []
+    report = {}
+    with StubAmadeusServer() as stub:
+        url = stub.url + "/v2/shopping/flight-offers?originLocationCode=JFK&destinationLocationCode=LAX"
+
+        bare = timed_requests(requests.get, url, args.requests)
+        report["bare_requests"] = summary(bare, stub.connections)
+
+        before = stub.connections
+        pooled_client = travel_app.HttpClient('bench', breaker=travel_app.CircuitBreaker('bench'))
+        pooled = timed_requests(pooled_client.get, url, args.requests)
+        report["pooled_client"] = summary(pooled, stub.connections - before)
+        report["saved_ms_per_request"] = round(statistics.mean(bare) - statistics.mean(pooled), 3)
+        if report["pooled_client"]["connections"] != 1:
+            failures.append("pooled client opened more than one connection")
+
+        retrying = travel_app.HttpClient('retry', max_retries=2, breaker=travel_app.CircuitBreaker('retry'))
+        response = retrying.get(stub.url + "/flaky/2")
+        report["retry"] = {"status": response.status_code, "retries": retrying.retries}
+        if response.status_code != 200 or retrying.retries != 2:
+            failures.append("flaky endpoint did not succeed after two retries")
+
+        breaker = travel_app.CircuitBreaker('failing', threshold=3, reset_timeout=60)
+        failing = travel_app.HttpClient('failing', max_retries=0, breaker=breaker)
+        for _ in range(breaker.threshold):
+            failing.get(stub.url + "/status/500")
+        calls_before = stub.count("/status/500")
+        started = time.perf_counter()
+        try:
+            failing.get(stub.url + "/status/500")
+            failures.append("circuit breaker did not open")
+        except travel_app.CircuitOpenError:
+            pass
+        report["circuit_breaker"] = {
+            "state": breaker.state,
+            "rejected": breaker.rejected,
+            "fail_fast_ms": round((time.perf_counter() - started) * 1000, 3)
+        }
+        if stub.count("/status/500") != calls_before:
+            failures.append("open circuit still called upstream")
+
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Seed a large bookings collection and time the Mongo-backed endpoints
+with and without the indexes from ``ensure_indexes()``.
+
+    python benchmarks/bench_mongo_indexes.py --uri mongodb://localhost:27017/
+    python benchmarks/bench_mongo_indexes.py --mongomock --bookings 50000
+
+Everything is written to a separate ``travel_booking_bench`` database. mongomock
+does not use indexes when querying, so only a real mongod gives meaningful
+before/after numbers; it is still useful to check the harness end to end.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as travel_app  # noqa: E402
+
+DESTINATIONS = ["JFK", "LAX", "CDG", "LHR", "NRT", "SYD", "DXB", "FRA", "AMS", "MAD",
+                "BCN", "FCO", "IST", "SIN", "HKG", "ICN", "YYZ", "MEX", "GRU", "JNB"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def use_database(database):
+    travel_app.db = database
+    travel_app.users_collection = database['users']
+    travel_app.bookings_collection = database['bookings']
+    travel_app.payments_collection = database['payments']
+    # The "before" phase must not create the indexes on its first request
+    travel_app.indexes_ensured = True
+
+
+def seed(database, users, bookings, batch_size=10000):
+    rng = random.Random(42)
+    database['users'].insert_many([{
+        "_id": f"user-{i}",
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "password": "secret"
+    } for i in range(users)])
+
+    filler = "x" * 2048
+    for start in range(0, bookings, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, bookings)):
+            day = rng.randint(1, 28)
+            month = rng.randint(1, 12)
+            batch.append({
+                "_id": f"booking-{i}",
+                "user_id": f"user-{rng.randrange(users)}",
+                "origin": rng.choice(DESTINATIONS),
+                "destination": rng.choice(DESTINATIONS),
+                "start_date": f"2024-{month:02d}-{day:02d}",
+                "end_date": f"2024-{month:02d}-{min(day + 7, 28):02d}",
+                "booking_date": "2024-01-01 00:00:00",
+                "flight_details": {"price": {"total": "250.00", "currency": "EUR"}, "raw": filler}
+            })
+        database['bookings'].insert_many(batch)
+
+
+def endpoint_calls(users, bookings):
+    rng = random.Random(7)
+
+    def login(client):
+        i = rng.randrange(users)
+        return client.post("/login", json={"email": f"user{i}@example.com", "password": "secret"})
+
+    def get_bookings(client):
+        return client.get(f"/get-bookings/user-{rng.randrange(users)}")
+
+    def search_bookings(client):
+        month = rng.randint(1, 12)
+        return client.get("/search-bookings", query_string={
+            "destination": rng.choice(DESTINATIONS),
+            "start_date": f"2024-{month:02d}-01",
+            "end_date": f"2024-{month:02d}-28"
+        })
+
+    def search_bookings_page(client):
+        month = rng.randint(1, 12)
+        return client.get("/search-bookings", query_string={
+            "destination": rng.choice(DESTINATIONS),
+            "start_date": f"2024-{month:02d}-01",
+            "limit": 50
+        })
+
+    def make_payment(client):
+        # Amount below the ticket price stops before Stripe, after both Mongo reads
+        return client.post("/make-payment", json={
+            "user_id": f"user-{rng.randrange(users)}",
+            "booking_id": f"booking-{rng.randrange(bookings)}",
+            "amount": 1
+        })
+
+    return {"login": login, "get_bookings": get_bookings, "search_bookings": search_bookings,
+            "search_bookings_page": search_bookings_page, "make_payment": make_payment}
+
+
+def measure(client, calls, requests_per_endpoint):
+    results = {}
+    for name, call in calls.items():
+        samples = []
+        for _ in range(requests_per_endpoint):
+            started = time.perf_counter()
+            call(client)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            "requests": len(samples),
+            "mean_ms": round(statistics.mean(samples), 3),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p99_ms": round(percentile(samples, 99), 3)
+        }
+    return results
+
+
+def query_plans(database):
+    plans = {}
+    queries = {
+        "login": (database['users'], {"email": "user1@example.com", "password": "secret"}),
+        "get_bookings": (database['bookings'], {"user_id": "user-1"}),
+        "search_bookings": (database['bookings'], {"destination": "JFK", "start_date": {"$gte": "2024-03-01"},
+                                                   "end_date": {"$lte": "2024-03-28"}}),
+        "search_bookings_page": (database['bookings'], {"destination": "JFK", "start_date": {"$gte": "2024-03-01"}},
+                                 travel_app.BOOKINGS_SORT)
+    }
+    for name, (collection, query, *sort) in queries.items():
+        try:
+            cursor = collection.find(query)
+            if sort:
+                cursor = cursor.sort(sort[0]).limit(51)
+            winning = cursor.explain()["queryPlanner"]["winningPlan"]
+        except Exception as e:
+            plans[name] = f"unavailable: {e}"
+            continue
+        stages = []
+        while winning:
+            stages.append(winning.get("stage") + (f"({winning['indexName']})" if "indexName" in winning else ""))
+            winning = winning.get("inputStage")
+        plans[name] = " <- ".join(stages)
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of a mongod")
+    parser.add_argument("--bookings", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and phase")
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        bench_client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        bench_client = MongoClient(args.uri)
+    bench_client.drop_database('travel_booking_bench')
+    database = bench_client['travel_booking_bench']
+    use_database(database)
+
+    started = time.perf_counter()
+    seed(database, args.users, args.bookings)
+    seed_seconds = time.perf_counter() - started
+
+    client = travel_app.app.test_client()
+    calls = endpoint_calls(args.users, args.bookings)
+
+    report = {"bookings": args.bookings, "users": args.users, "seed_seconds": round(seed_seconds, 1)}
+    report["before"] = {"latency": measure(client, calls, args.requests), "plans": query_plans(database)}
+    travel_app.ensure_indexes()
+    report["after"] = {"latency": measure(client, calls, args.requests), "plans": query_plans(database)}
+
+    print(json.dumps(report, indent=2))
+    bench_client.drop_database('travel_booking_bench')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Throughput of /make-payment in sync mode against the queued (async) mode,
+end to end on mongomock with a fake Stripe that adds fixed latency.
+
+    python benchmarks/bench_payments.py --payments 200 --clients 8 --stripe-latency 0.3
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock  # noqa: E402
+
+import app as travel_app  # noqa: E402
+from stubs import FakeStripe  # noqa: E402
+
+
+def use_database(database):
+    travel_app.db = database
+    travel_app.users_collection = database['users']
+    travel_app.bookings_collection = database['bookings']
+    travel_app.payments_collection = database['payments']
+    travel_app.ensure_indexes()
+
+
+def seed(database, payments):
+    database['users'].insert_one({"_id": "user-1", "email": "user1@example.com", "password": "secret"})
+    database['bookings'].insert_many([{
+        "_id": f"booking-{i}",
+        "user_id": "user-1",
+        "flight_details": {"price": {"total": "120.00"}}
+    } for i in range(payments)])
+
+
+def run_clients(payments, clients, mode):
+    # Each client thread posts its share of payments, like concurrent Flask workers
+    statuses = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        client = travel_app.app.test_client()
+        for i in range(offset, payments, clients):
+            response = client.post("/make-payment", json={
+                "user_id": "user-1", "booking_id": f"booking-{i}", "amount": 150, "mode": mode,
+                "idempotency_key": f"{mode}-{i}"
+            })
+            with lock:
+                statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, statuses
+
+
+def wait_for_queue(payments_collection, timeout=300):
+    deadline = time.monotonic() + timeout
+    while payments_collection.count_documents({"status": "pending"}) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--stripe-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    report = {"payments": args.payments, "clients": args.clients, "payment_workers": travel_app.PAYMENT_WORKERS}
+    for mode in ("sync", "async"):
+        database = mongomock.MongoClient()['travel_booking_bench']
+        use_database(database)
+        seed(database, args.payments)
+        fake_stripe = FakeStripe(latency=args.stripe_latency).install(travel_app)
+
+        started = time.perf_counter()
+        elapsed, statuses = run_clients(args.payments, args.clients, mode)
+        result = {
+            "accepted_per_s": round(len(statuses) / elapsed, 1),
+            "request_phase_s": round(elapsed, 3),
+            "status_codes": {str(code): statuses.count(code) for code in sorted(set(statuses))}
+        }
+        if mode == "async":
+            wait_for_queue(database['payments'])
+            result["drained_s"] = round(time.perf_counter() - started, 3)
+            result["created"] = database['payments'].count_documents({"status": "created"})
+            result["failed"] = database['payments'].count_documents({"status": "failed"})
+
+            # A retried request with the same key must not create a second payment or intent
+            client = travel_app.app.test_client()
+            retry = client.post("/make-payment", json={"user_id": "user-1", "booking_id": "booking-0",
+                                                       "amount": 150, "mode": "async",
+                                                       "idempotency_key": "async-0"})
+            result["duplicate_request_status"] = retry.status_code
+            result["payment_documents"] = database['payments'].count_documents({})
+        result["stripe_calls"] = fake_stripe.calls
+        report[mode] = result
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Replay mixed booking traffic against the app and report per-route latency.
+
+Each virtual user session runs register -> login -> search-flights ->
+book-trip -> make-payment -> get-bookings over HTTP against the app served
+by the werkzeug dev server or by gunicorn workers. Mongo, Amadeus and Stripe
+are local stand-ins: mongomock or a local mongod, the stub Amadeus server
+from stubs.py and FakeStripe.
+
+    python benchmarks/loadtest.py --sessions 500 --users 16 --output bench.json
+    python benchmarks/loadtest.py --server gunicorn --workers 4 --mongo-uri mongodb://localhost:27017/
+    python benchmarks/loadtest.py --trace sessions.jsonl --baseline bench.json
+
+A trace is a JSONL file with one session per line, for example
+``{"origin": "JFK", "destination": "LAX", "departure_date": "2030-01-10",
+"payment_mode": "async"}``; missing fields are filled in from the seed.
+Sessions are replayed in order, cycling if ``--sessions`` is larger.
+
+The JSON report has throughput and p50/p95/p99 per route. ``--baseline``
+adds the change in p95 and throughput against an earlier report.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import app as travel_app  # noqa: E402
+from stubs import FakeStripe, StubAmadeusServer  # noqa: E402
+
+AIRPORTS = ["JFK", "LAX", "SFO", "ORD", "CDG", "LHR", "FRA", "AMS", "MAD", "NRT"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def setup_backends(args, stub):
+    travel_app.AMADEUS_AUTH_URL = stub.url + "/v1/security/oauth2/token"
+    travel_app.AMADEUS_FLIGHT_OFFERS_URL = stub.url + "/v2/shopping/flight-offers"
+    FakeStripe(latency=args.stripe_latency).install(travel_app)
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        mongo = MongoClient(args.mongo_uri)
+    else:
+        import mongomock
+        mongo = mongomock.MongoClient()
+    mongo.drop_database('travel_booking_loadtest')
+    database = mongo['travel_booking_loadtest']
+    travel_app.db = database
+    travel_app.users_collection = travel_app.InstrumentedCollection(database['users'])
+    travel_app.bookings_collection = travel_app.InstrumentedCollection(database['bookings'])
+    travel_app.payments_collection = travel_app.InstrumentedCollection(database['payments'])
+    travel_app.offers_collection = travel_app.InstrumentedCollection(database['offers'])
+    travel_app.ensure_indexes()
+    return mongo
+
+
+def serve_dev(port):
+    from werkzeug.serving import make_server
+    # Access logging would be part of every measured request
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", port, travel_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def serve_gunicorn(port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class LoadTestApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("loglevel", "warning")
+
+        def load(self):
+            return travel_app.app
+
+    # Forked after the stand-ins are patched in, so every worker inherits them
+    process = multiprocessing.get_context("fork").Process(target=LoadTestApplication().run, daemon=True)
+    process.start()
+    return process.terminate
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + "/metrics", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"app did not start on {base_url}")
+
+
+def load_sessions(args):
+    rng = random.Random(args.seed)
+    trace = []
+    if args.trace:
+        with open(args.trace) as trace_file:
+            trace = [json.loads(line) for line in trace_file if line.strip()]
+    sessions = []
+    for i in range(args.sessions):
+        origin, destination = rng.sample(AIRPORTS, 2)
+        session = {
+            "origin": origin,
+            "destination": destination,
+            "departure_date": (date.today() + timedelta(days=rng.randint(7, 7 + args.date_spread))).isoformat(),
+            "payment_mode": args.payment_mode
+        }
+        if trace:
+            session.update(trace[i % len(trace)])
+        sessions.append(session)
+    return sessions
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def call(self, route, http, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = http.request(method, url, timeout=60, **kwargs)
+        except requests.exceptions.RequestException:
+            response = None
+        elapsed = time.perf_counter() - started
+        failed = response is None or response.status_code >= 400
+        with self._lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if failed:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return None if failed else response.json()
+
+
+def run_session(base_url, session, recorder):
+    http = requests.Session()
+    email = f"{uuid.uuid4().hex}@loadtest.invalid"
+    user = recorder.call("/register", http, "POST", base_url + "/register",
+                         json={"name": "Load Test", "email": email, "password": "secret"})
+    if not user:
+        return
+    user_id = user["user_id"]
+    if not recorder.call("/login", http, "POST", base_url + "/login", json={"email": email, "password": "secret"}):
+        return
+    flight_offers = recorder.call("/search-flights", http, "GET", base_url + "/search-flights", params={
+        "origin": session["origin"], "destination": session["destination"],
+        "departure_date": session["departure_date"]})
+    if not flight_offers or not flight_offers.get("data"):
+        return
+    offer = min(flight_offers["data"], key=lambda offer: float(offer["price"]["total"]))
+    booking = recorder.call("/book-trip", http, "POST", base_url + "/book-trip",
+                            json={"user_id": user_id, "offer_token": offer["offer_token"]})
+    if not booking:
+        return
+    recorder.call("/make-payment", http, "POST", base_url + "/make-payment", json={
+        "user_id": user_id, "booking_id": booking["booking_id"],
+        "amount": float(offer["price"]["total"]) + 1, "mode": session["payment_mode"]})
+    recorder.call("/get-bookings", http, "GET", f"{base_url}/get-bookings/{user_id}")
+
+
+def run_load(base_url, sessions, users):
+    recorder = Recorder()
+    queue = list(reversed(sessions))
+    lock = threading.Lock()
+
+    def virtual_user():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                session = queue.pop()
+            run_session(base_url, session, recorder)
+
+    threads = [threading.Thread(target=virtual_user) for _ in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def build_report(args, recorder, elapsed, sessions):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        routes[route] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(route, 0),
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "mean_ms": round(statistics.mean(samples) * 1000, 3),
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3)
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "commit": git_commit(),
+        "config": {
+            "server": args.server, "workers": args.workers, "threads": args.threads, "users": args.users,
+            "sessions": len(sessions), "seed": args.seed, "trace": args.trace,
+            "mongo": args.mongo_uri or "mongomock", "amadeus_latency_s": args.amadeus_latency,
+            "offers": args.offers, "offer_bytes": args.offer_bytes, "stripe_latency_s": args.stripe_latency,
+            "payment_mode": args.payment_mode
+        },
+        "duration_s": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(route["errors"] for route in routes.values()),
+        "throughput_rps": round(total / elapsed, 2),
+        "routes": routes
+    }
+
+
+def compare(report, baseline):
+    changes = {}
+    for route, current in report["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if not previous:
+            continue
+        changes[route] = {
+            "p95_ms_delta": round(current["p95_ms"] - previous["p95_ms"], 3),
+            "p95_change_pct": round((current["p95_ms"] / previous["p95_ms"] - 1) * 100, 1) if previous["p95_ms"] else None,
+            "throughput_change_pct": round((current["throughput_rps"] / previous["throughput_rps"] - 1) * 100, 1)
+            if previous["throughput_rps"] else None
+        }
+    return {"commit": baseline.get("commit"), "routes": changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("dev", "gunicorn"), default="dev")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mongo-uri", help="local mongod to use instead of mongomock")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace", help="JSONL file of sessions to replay")
+    parser.add_argument("--date-spread", type=int, default=14, help="departure dates spread over this many days")
+    parser.add_argument("--amadeus-latency", type=float, default=0.1)
+    parser.add_argument("--offers", type=int, default=20, help="offers per search response")
+    parser.add_argument("--offer-bytes", type=int, default=2048)
+    parser.add_argument("--stripe-latency", type=float, default=0.2)
+    parser.add_argument("--payment-mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    if args.server == "gunicorn" and not args.mongo_uri:
+        parser.error("gunicorn workers do not share mongomock data, pass --mongo-uri")
+
+    sessions = load_sessions(args)
+    base_url = f"http://127.0.0.1:{args.port}"
+    with StubAmadeusServer(latency=args.amadeus_latency, offers=args.offers, offer_bytes=args.offer_bytes) as stub:
+        mongo = setup_backends(args, stub)
+        if args.server == "dev":
+            stop = serve_dev(args.port)
+        else:
+            stop = serve_gunicorn(args.port, args.workers, args.threads)
+        try:
+            wait_until_up(base_url)
+            recorder, elapsed = run_load(base_url, sessions, args.users)
+        finally:
+            stop()
+        report = build_report(args, recorder, elapsed, sessions)
+        report["upstream_calls"] = dict(sorted(stub.requests.items()))
+        mongo.drop_database('travel_booking_loadtest')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["baseline"] = compare(report, json.load(baseline_file))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
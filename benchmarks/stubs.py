@@ -0,0 +1,175 @@
+"""Local stand-ins for the upstream services used by the benchmarks."""
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import stripe
+
+
+class StubAmadeusServer:
+    """Threaded HTTP server that answers like the Amadeus test API.
+
+    ``latency`` seconds are added to every response, ``offers`` flight offers
+    of roughly ``offer_bytes`` each are returned per search. ``/status/<code>``
+    answers with that status code, ``/flaky/<n>`` fails with 503 for the first
+    ``n`` calls and then succeeds, ``/retry-after/<s>`` answers the first call
+    with 429 and ``Retry-After: <s>``, ``/redirect-loop`` redirects to itself.
+    Keep-alive is supported, and every new TCP
+    connection is counted in ``connections``.
+    """
+
+    def __init__(self, latency=0.0, offers=5, offer_bytes=2048, token_expires_in=1799):
+        self.latency = latency
+        self.offers = offers
+        self.offer_bytes = offer_bytes
+        self.token_expires_in = token_expires_in
+        self.connections = 0
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._tokens = itertools.count(1)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, path):
+        with self._lock:
+            return self.requests.get(path, 0)
+
+    def flight_offers(self, origin, destination, departure_date):
+        padding = "x" * max(0, self.offer_bytes - 600)
+        return {"meta": {"count": self.offers}, "data": [{
+            "id": str(i + 1),
+            "price": {"total": f"{100 + 17 * i + len(departure_date) % 7:.2f}", "currency": "EUR"},
+            "validatingAirlineCodes": ["XX"],
+            "itineraries": [{"segments": [{
+                "carrierCode": "XX",
+                "number": str(100 + i),
+                "departure": {"iataCode": origin, "at": f"{departure_date}T08:00:00"},
+                "arrival": {"iataCode": destination, "at": f"{departure_date}T12:00:00"}
+            }]}],
+            "fareDetails": padding
+        } for i in range(self.offers)]}
+
+    def _record(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            return self.requests[path]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                self._dispatch()
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                calls = stub._record(url.path)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if url.path == "/v1/security/oauth2/token":
+                    return self._reply(200, {"access_token": f"token-{next(stub._tokens)}",
+                                             "expires_in": stub.token_expires_in})
+                if url.path == "/v2/shopping/flight-offers":
+                    params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    return self._reply(200, stub.flight_offers(params.get("originLocationCode", ""),
+                                                               params.get("destinationLocationCode", ""),
+                                                               params.get("departureDate", "")))
+                if url.path.startswith("/status/"):
+                    return self._reply(int(url.path.rsplit("/", 1)[1]), {})
+                if url.path.startswith("/flaky/"):
+                    failures = int(url.path.rsplit("/", 1)[1])
+                    return self._reply(503 if calls <= failures else 200, {"calls": calls})
+                if url.path.startswith("/retry-after/"):
+                    if calls == 1:
+                        return self._reply(429, {}, {"Retry-After": url.path.rsplit("/", 1)[1]})
+                    return self._reply(200, {"calls": calls})
+                if url.path == "/redirect-loop":
+                    return self._reply(302, {}, {"Location": url.path})
+                self._reply(404, {})
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class FakeStripe:
+    """Drop-in for the ``stripe`` module as used by app.py.
+
+    ``PaymentIntent.create`` sleeps ``latency`` seconds and returns the same
+    intent again for a repeated idempotency key, like Stripe does.
+    """
+
+    error = stripe.error
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.PaymentIntent = self
+        self.intents = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def install(self, module):
+        module.stripe = self
+        return self
+
+    def create(self, amount, currency, idempotency_key=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if idempotency_key in self.intents:
+                return self.intents[idempotency_key]
+            number = next(self._ids)
+            intent = {"id": f"pi_fake_{number}", "client_secret": f"pi_fake_{number}_secret",
+                      "amount": amount, "currency": currency}
+            if idempotency_key:
+                self.intents[idempotency_key] = intent
+            return intent
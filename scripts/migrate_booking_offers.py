@@ -0,0 +1,70 @@
+"""Convert bookings that embed ``flight_details`` to the compact schema.
+
+Each booking gets the typed price/currency/carrier/segments/times fields,
+the raw offer is stored once in the ``offers`` collection and referenced by
+``offer_hash``, and ``flight_details`` is removed. Bookings are processed in
+``_id`` order in batches; the script can be stopped and run again, it only
+picks up bookings that still have ``flight_details``.
+
+    MONGO_URI=mongodb://localhost:27017/ python scripts/migrate_booking_offers.py --batch-size 500
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import UpdateOne  # noqa: E402
+
+import app as travel_app  # noqa: E402
+
+
+def migrate(batch_size, dry_run=False, limit=None):
+    bookings = travel_app.bookings_collection
+    migrated = skipped = 0
+    last_id = None
+    while limit is None or migrated + skipped < limit:
+        query = {"flight_details": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(bookings.find(query, {"flight_details": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        updates = []
+        for booking in batch:
+            offer = booking["flight_details"]
+            if not isinstance(offer, dict) or not offer.get("price"):
+                skipped += 1
+                continue
+            if dry_run:
+                migrated += 1
+                continue
+            updates.append(UpdateOne({"_id": booking["_id"]}, {
+                "$set": travel_app.booking_offer_fields(offer),
+                "$unset": {"flight_details": ""}
+            }))
+        if updates:
+            bookings.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+        print(f"migrated {migrated}, skipped {skipped}, last _id {last_id}", file=sys.stderr)
+    return migrated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--limit", type=int, help="stop after this many bookings")
+    parser.add_argument("--dry-run", action="store_true", help="count bookings without changing them")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    migrated, skipped = migrate(args.batch_size, args.dry_run, args.limit)
+    print(f"{'would migrate' if args.dry_run else 'migrated'} {migrated} bookings, skipped {skipped} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+import requests
+
+import app as travel_app
+from stubs import StubAmadeusServer
+
+
+@pytest.fixture
+def stub():
+    with StubAmadeusServer() as server:
+        yield server
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(travel_app, "HTTP_BACKOFF_BASE", 0.001)
+
+
+def make_client(threshold=5, reset_timeout=60, max_retries=3):
+    breaker = travel_app.CircuitBreaker("test", threshold=threshold, reset_timeout=reset_timeout)
+    return travel_app.HttpClient("test", max_retries=max_retries, breaker=breaker)
+
+
+def test_connections_are_reused(stub):
+    client = make_client()
+    for _ in range(20):
+        assert client.get(stub.url + "/status/200").status_code == 200
+    assert stub.connections == 1
+
+
+def test_retries_until_upstream_recovers(stub):
+    client = make_client(max_retries=3)
+    response = client.get(stub.url + "/flaky/2")
+    assert response.status_code == 200
+    assert stub.count("/flaky/2") == 3
+    assert client.retries == 2
+    assert client.breaker.state == "closed"
+
+
+def test_returns_last_response_when_retries_run_out(stub):
+    client = make_client(max_retries=1)
+    assert client.get(stub.url + "/status/503").status_code == 503
+    assert stub.count("/status/503") == 2
+
+
+def test_honours_retry_after(stub):
+    client = make_client()
+    started = time.monotonic()
+    response = client.get(stub.url + "/retry-after/1")
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 1
+    assert stub.count("/retry-after/1") == 2
+
+
+def test_breaker_opens_and_fails_fast(stub):
+    client = make_client(threshold=2, max_retries=0)
+    for _ in range(2):
+        assert client.get(stub.url + "/status/500").status_code == 500
+    assert client.breaker.state == "open"
+    with pytest.raises(travel_app.CircuitOpenError):
+        client.get(stub.url + "/status/500")
+    assert stub.count("/status/500") == 2
+    assert client.breaker.rejected == 1
+
+
+def test_half_open_trial_closes_on_success(stub):
+    client = make_client(threshold=1, reset_timeout=0.05, max_retries=0)
+    client.get(stub.url + "/status/500")
+    assert client.breaker.state == "open"
+    time.sleep(0.06)
+    assert client.breaker.state == "half-open"
+    assert client.get(stub.url + "/status/200").status_code == 200
+    assert client.breaker.state == "closed"
+
+
+def test_half_open_trial_reopens_on_failure(stub):
+    client = make_client(threshold=1, reset_timeout=0.05, max_retries=0)
+    client.get(stub.url + "/status/500")
+    time.sleep(0.06)
+    client.get(stub.url + "/status/500")
+    assert client.breaker.state == "open"
+    with pytest.raises(travel_app.CircuitOpenError):
+        client.get(stub.url + "/status/200")
+
+
+def test_unexpected_errors_do_not_wedge_the_breaker(stub):
+    client = make_client(threshold=1, reset_timeout=0.05, max_retries=0)
+    client.get(stub.url + "/status/500")
+    time.sleep(0.06)
+    with pytest.raises(requests.exceptions.TooManyRedirects):
+        client.get(stub.url + "/redirect-loop")
+    assert client.breaker.state == "open"
+    time.sleep(0.06)
+    assert client.get(stub.url + "/status/200").status_code == 200
+    assert client.breaker.state == "closed"